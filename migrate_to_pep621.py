@@ -1,232 +1,315 @@
 #!/usr/bin/env python3
-\"\"\"
+"""
 migrate_to_pep621.py
 --------------------
 Convert a Poetry-style pyproject.toml ([tool.poetry]) to PEP 621 ([project]).
 - Translates dependencies (incl. ^/~ constraints) to PEP 440 ranges.
-- Converts path/git deps to PEP 508 strings.
+- Converts path/git deps to PEP 508 strings (paths relative to the pyproject.toml's directory).
 - Maps [tool.poetry.group.dev.dependencies] -> [project.optional-dependencies].
 - Preserves scripts and basic metadata.
 - Adds [build-system] for poetry-core if missing.
 - Emits warnings for develop=true (editable) because PEP 621 can't encode it.
+- Serializes with tomli_w when installed (falls back to a built-in writer).
 Usage:
     python migrate_to_pep621.py /path/to/pyproject.toml [--dry-run] [--out /path/to/output.toml]
-\"\"\"
+    python migrate_to_pep621.py --glob 'packages/**/pyproject.toml' [--dry-run] [--jobs N]
+"""
 
 from __future__ import annotations
 
 import argparse
+import glob
+import io
+import os
 import re
 import sys
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
 
 try:
     import tomllib  # Python 3.11+
 except Exception:
     tomllib = None  # type: ignore
 
+try:
+    import tomli_w  # optional: real TOML writer
+except Exception:
+    tomli_w = None  # type: ignore
+
+
+def split_author(s: str) -> Tuple[str, str]:
+    # "Name <email>" or "Name"; a plain rfind/slice is enough for this grammar.
+    s = s.strip()
+    i = s.rfind("<")
+    email = s[i + 1:-1].strip() if i > 0 and s.endswith(">") else ""
+    return (s[:i].rstrip(), email) if email else (s, "")
+
 
 def parse_authors(poetry_authors: List[str]) -> List[Dict[str, str]]:
     out = []
-    pat = re.compile(r"^\\s*(?P<name>.+?)\\s*(?:<(?P<email>[^>]+)>)?\\s*$")
-    for s in poetry_authors or []:
-        m = pat.match(s)
-        if not m:
-            out.append({\"name\": s})
-            continue
-        d = {\"name\": m.group(\"name\").strip()}
-        if m.group(\"email\"): d[\"email\"] = m.group(\"email\").strip()
-        out.append(d)
+    for name, email in map(split_author, poetry_authors or []):
+        out.append({"name": name, "email": email} if email else {"name": name})
     return out
 
 
-def caret_to_range(ver: str) -> str:
-    if not ver.startswith(\"^\"): return ver
-    base = ver[1:]
-    parts = [int(p) for p in base.split(\".\")]
-    while len(parts) < 3: parts.append(0)
-    maj, minor, patch = parts[:3]
-    if maj > 0: upper = f\"{maj+1}.0.0\"
-    elif minor > 0: upper = f\"0.{minor+1}.0\"
-    else: upper = f\"0.0.{patch+1}\"
-    return f\">={maj}.{minor}.{patch},<{upper}\"
-
-
-def tilde_to_range(ver: str) -> str:
-    if not ver.startswith(\"~\"): return ver
-    base = ver[1:]
-    parts = base.split(\".\")
-    if len(parts) == 1:
-        lower = f\"{parts[0]}.0\"
-        upper = f\"{int(parts[0]) + 1}.0\"
-        return f\">={lower},<{upper}\"
-    if len(parts) == 2:
-        major, minor = int(parts[0]), int(parts[1])
-        return f\">={major}.{minor},<{major}.{minor+1}\"
-    major, minor, patch = int(parts[0]), int(parts[1]), int(parts[2])
-    return f\">={major}.{minor}.{patch},<{major}.{minor+1}.0\"
+# 0* drops leading zeros so components can be reused as strings; only the
+# bumped upper-bound component goes through int(). re.ASCII keeps non-ASCII
+# digits (e.g. fullwidth) out of the output.
+_CARET_TILDE_RE = re.compile(r"^([~^])\s*0*(\d+)(?:\.0*(\d+))?(?:\.0*(\d+))?(?:\.\d+)*$", re.ASCII)
 
 
+@lru_cache(maxsize=1024)
 def normalize_version_constraint(ver: str) -> str:
+    # ^X[.Y[.Z]] / ~X[.Y[.Z]] -> PEP 440 range; PEP 440 specifiers (incl. ~=) pass through.
     ver = ver.strip()
-    if ver.startswith(\"^\"): return caret_to_range(ver)
-    if ver.startswith(\"~\"): return tilde_to_range(ver)
-    return ver
+    m = _CARET_TILDE_RE.match(ver)
+    if not m:
+        if ver.startswith(("^", "~")) and not ver.startswith("~="):
+            raise ValueError(f"Cannot convert version constraint {ver!r} to a PEP 440 range.")
+        return ver
+    op, a, b, c = m.groups()
+    if op == "^":
+        b, c = b or "0", c or "0"
+        upper = f"{int(a)+1}.0.0" if a != "0" else f"0.{int(b)+1}.0" if b != "0" else f"0.0.{int(c)+1}"
+        return f">={a}.{b}.{c},<{upper}"
+    if b is None: return f">={a}.0,<{int(a)+1}.0"
+    if c is None: return f">={a}.{b},<{a}.{int(b)+1}"
+    return f">={a}.{b}.{c},<{a}.{int(b)+1}.0"
 
 
-def dep_table_to_pep508(name: str, val: Any, warnings: List[str]) -> str:
+def dep_table_to_pep508(name: str, val: Any, warnings: List[str], cwd: Path | None = None) -> str:
     if isinstance(val, str):
         constraint = normalize_version_constraint(val)
-        return f\"{name}{(' ' + constraint) if constraint else ''}\"
+        return f"{name}{(' ' + constraint) if constraint else ''}"
     if isinstance(val, dict):
-        if \"path\" in val:
-            path = Path(val[\"path\"]).expanduser()
-            if val.get(\"develop\"):  # editable not supported in PEP 621
-                warnings.append(f\"[editable-warning] {name} uses develop=true (editable). PEP 621 cannot encode this. "
-                                f\"Use `pip install -e {path}` inside the venv for live edits.\")
-            abs_path = path if path.is_absolute() else (Path.cwd() / path).resolve()
-            return f\"{name} @ file://{abs_path}\"
-        if \"git\" in val:
-            url = val[\"git\"]
-            ref = val.get(\"rev\") or val.get(\"tag\") or val.get(\"branch\")
-            return f\"{name} @ git+{url}@{ref}\" if ref else f\"{name} @ git+{url}\"
-        version = val.get(\"version\")
-        extras = val.get(\"extras\") or []
-        markers = val.get(\"markers\")
-        pieces = [name]
-        if extras: pieces[-1] = f\"{name}[{','.join(extras)}]\"
-        if version: pieces.append(normalize_version_constraint(version))
-        if markers: pieces.append(f\"; {markers}\")
-        return \" \".join(pieces)
+        if "path" in val:
+            path = Path(val["path"]).expanduser()
+            if val.get("develop"):  # editable not supported in PEP 621
+                warnings.append(f"[editable-warning] {name} uses develop=true (editable). PEP 621 cannot encode this. "
+                                f"Use `pip install -e {path}` inside the venv for live edits.")
+            # normpath, not resolve(): lexical only, no stat() per path component
+            abs_path = path if path.is_absolute() else os.path.normpath((cwd or Path.cwd()) / path)
+            return f"{name} @ file://{abs_path}"
+        if "git" in val:
+            url = val["git"]
+            ref = val.get("rev") or val.get("tag") or val.get("branch")
+            return f"{name} @ git+{url}@{ref}" if ref else f"{name} @ git+{url}"
+        version = val.get("version")
+        extras = val.get("extras") or []
+        markers = val.get("markers")
+        head = f"{name}[{','.join(extras)}]" if extras else name
+        tail = f" {normalize_version_constraint(version)}" if version else ""
+        marker = f" ; {markers}" if markers else ""
+        return f"{head}{tail}{marker}"
     return str(val)
 
 
-def poetry_deps_to_pep621(deps: Dict[str, Any], warnings: List[str]) -> List[str]:
-    out: List[str] = []
+def poetry_deps_to_pep621(deps: Dict[str, Any], warnings: List[str], cwd: Path | None = None) -> List[str]:
+    # Sort on the lowercased name, computed once per dep rather than per comparison.
+    pairs: List[Tuple[str, str]] = []
     for name, val in (deps or {}).items():
-        if name.lower() == \"python\": continue
-        out.append(dep_table_to_pep508(name, val, warnings))
-    return sorted(out, key=str.lower)
+        key = name.lower()
+        if key == "python": continue
+        pairs.append((key, dep_table_to_pep508(name, val, warnings, cwd)))
+    pairs.sort()
+    return [p[1] for p in pairs]
+
+
+# Everything a TOML basic string can't hold verbatim: backslash, quote and control chars.
+_TOML_ESCAPE = str.maketrans({
+    **{chr(i): f"\\u{i:04x}" for i in (*range(0x20), 0x7F)},
+    "\\": "\\\\", '"': '\\"', "\b": "\\b", "\t": "\\t", "\n": "\\n", "\f": "\\f", "\r": "\\r",
+})
 
 
 def toml_escape(s: str) -> str:
-    return s.replace(\"\\\\\", \"\\\\\\\\\").replace('\"', '\\\\\"')
+    return s.translate(_TOML_ESCAPE)
+
+
+def dump_toml_array_str(arr: Iterable[str], indent: int = 0) -> str:
+    # Formats while draining arr, so any iterable (e.g. a generator) works.
+    pad = " " * indent
+    items = ",\n".join(f'{pad}"{toml_escape(x)}"' for x in arr)
+    return f"[\n{items}\n{' ' * max(indent - 2, 0)}]"
+
+
+def iter_author_lines(poetry_authors: List[str]) -> Iterator[str]:
+    # Poetry author strings straight to inline-table lines, no intermediate dicts.
+    for name, email in map(split_author, poetry_authors or []):
+        if email:
+            yield f'  {{ name = "{toml_escape(name)}", email = "{toml_escape(email)}" }},\n'
+        else:
+            yield f'  {{ name = "{toml_escape(name)}" }},\n'
+
 
+def dump_pep621_toml(proj: Dict[str, Any], bs: Dict[str, Any], authors: List[str] | None = None) -> str:
+    # Fallback when tomli_w is not installed. Keys of [project] must all precede
+    # its sub-tables, otherwise they would land in e.g. [project.urls].
+    # Authors come only from the authors argument (raw Poetry strings), never from proj.
+    buf = io.StringIO()
+    w = buf.write
+    w("[project]\n")
+    for key in ("name", "version", "description", "readme"):
+        if key in proj: w(f'{key} = "{toml_escape(proj[key])}"\n')
+    if authors:
+        w("authors = [\n")
+        for line in iter_author_lines(authors): w(line)
+        w("]\n")
+    if "license" in proj:
+        lic = proj["license"]
+        if isinstance(lic, dict) and "text" in lic:
+            w(f'license = {{ text = "{toml_escape(lic["text"])}" }}\n')
+    if "dependencies" in proj:
+        w(f'dependencies = {dump_toml_array_str(proj["dependencies"], indent=2)}\n')
+    if "urls" in proj:
+        w("\n[project.urls]\n")
+        for k, v in proj["urls"].items():
+            w(f'{k} = "{toml_escape(v)}"\n')
+    if "optional-dependencies" in proj:
+        w("\n[project.optional-dependencies]\n")
+        for group, arr in proj["optional-dependencies"].items():
+            w(f"{group} = {dump_toml_array_str(arr, indent=2)}\n")
+    if "scripts" in proj:
+        w("\n[project.scripts]\n")
+        for k, v in proj["scripts"].items():
+            w(f'{k} = "{toml_escape(v)}"\n')
+    requires = bs.get("requires", ["poetry-core>=1.9.0"])
+    requires_items = ", ".join(f'"{toml_escape(x)}"' for x in requires)
+    w(f"\n[build-system]\nrequires = [{requires_items}]\n")
+    w(f'build-backend = "{toml_escape(bs.get("build-backend", "poetry.core.masonry.api"))}"\n')
+    return buf.getvalue()
 
-def dump_toml_array_str(arr: List[str], indent: int = 0) -> str:
-    pad = \" \" * indent
-    items = \",\\n\".join(pad + f'\"{toml_escape(x)}\"' for x in arr)
-    return \"[\\n\" + items + \"\\n\" + (\" \" * max(indent - 2, 0)) + \"]\"
 
+_URL_LABELS = {"homepage": "Homepage", "repository": "Repository", "documentation": "Documentation"}
 
-def build_pep621_toml(poetry: Dict[str, Any], build_system: Dict[str, Any], warnings: List[str]) -> str:
+
+def build_pep621_toml(poetry: Dict[str, Any], build_system: Dict[str, Any], warnings: List[str],
+                      cwd: Path | None = None) -> str:
     proj: Dict[str, Any] = {}
-    proj[\"name\"] = poetry.get(\"name\", \"unknown-package\")
-    proj[\"version\"] = poetry.get(\"version\", \"0.1.0\")
-    if poetry.get(\"description\"): proj[\"description\"] = poetry[\"description\"]
-    if poetry.get(\"readme\"): proj[\"readme\"] = poetry[\"readme\"]
-    authors = parse_authors(poetry.get(\"authors\", []))
-    if authors: proj[\"authors\"] = authors
-    if poetry.get(\"license\"): proj[\"license\"] = {\"text\": poetry[\"license\"]}
+    proj["name"] = poetry.get("name", "unknown-package")
+    proj["version"] = poetry.get("version", "0.1.0")
+    if poetry.get("description"): proj["description"] = poetry["description"]
+    if poetry.get("readme"): proj["readme"] = poetry["readme"]
+    authors = poetry.get("authors") or []  # raw strings; each writer formats them itself
+    if poetry.get("license"): proj["license"] = {"text": poetry["license"]}
     urls = {}
-    for k in (\"homepage\", \"repository\", \"documentation\"):
-        if poetry.get(k):
-            label = {\"homepage\": \"Homepage\", \"repository\": \"Repository\", \"documentation\": \"Documentation\"}[k]
-            urls[label] = poetry[k]
-    if urls: proj[\"urls\"] = urls
-    dep_list = poetry_deps_to_pep621(poetry.get(\"dependencies\", {}), warnings)
-    if dep_list: proj[\"dependencies\"] = dep_list
+    for k, label in _URL_LABELS.items():
+        v = poetry.get(k)
+        if v: urls[label] = v
+    if urls: proj["urls"] = urls
+    dep_list = poetry_deps_to_pep621(poetry.get("dependencies", {}), warnings, cwd)
+    if dep_list: proj["dependencies"] = dep_list
     optional_deps = {}
-    groups = poetry.get(\"group\", {}) if isinstance(poetry.get(\"group\", {}), dict) else {}
-    dev_group = groups.get(\"dev\", {})
-    dev_deps = poetry_deps_to_pep621(dev_group.get(\"dependencies\", {}), warnings)
-    if dev_deps: optional_deps[\"dev\"] = dev_deps
-    if optional_deps: proj[\"optional-dependencies\"] = optional_deps
-    scripts = poetry.get(\"scripts\", {}) or {}
-    if scripts: proj[\"scripts\"] = scripts
-    bs = build_system or {\"requires\": [\"poetry-core>=1.9.0\"], \"build-backend\": \"poetry.core.masonry.api\"}
-    lines: List[str] = []
-    lines.append(\"[project]\")
-    for key in (\"name\", \"version\", \"description\", \"readme\"):
-        if key in proj: lines.append(f'{key} = \"{toml_escape(proj[key])}\"')
-    if \"authors\" in proj:
-        lines.append(\"authors = [\")
-        for a in proj[\"authors\"]:
-            if \"email\" in a:
-                lines.append(f'  {{ name = \"{toml_escape(a[\"name\"])}\", email = \"{toml_escape(a[\"email\"])}\" }},')
-            else:
-                lines.append(f'  {{ name = \"{toml_escape(a[\"name\"])}\" }},')
-        lines.append(\"]\")
-    if \"license\" in proj:
-        lic = proj[\"license\"]
-        if isinstance(lic, dict) and \"text\" in lic:
-            lines.append(f'license = {{ text = \"{toml_escape(lic[\"text\"]) }\" }}')
-    if \"urls\" in proj:
-        lines.append(\"[project.urls]\")
-        for k, v in proj[\"urls\"].items():
-            lines.append(f'{k} = \"{toml_escape(v)}\"')
-    if \"dependencies\" in proj:
-        lines.append(\"\")
-        lines.append(\"dependencies = \" + dump_toml_array_str(proj[\"dependencies\"], indent=2))
-    if \"optional-dependencies\" in proj:
-        lines.append(\"\")
-        lines.append(\"[project.optional-dependencies]\")
-        for group, arr in proj[\"optional-dependencies\"].items():
-            arr_txt = dump_toml_array_str(arr, indent=2)
-            lines.append(f\"{group} = {arr_txt}\")
-    if \"scripts\" in proj:
-        lines.append(\"\")
-        lines.append(\"[project.scripts]\")
-        for k, v in proj[\"scripts\"].items():
-            lines.append(f'{k} = \"{toml_escape(v)}\"')
-    lines.append(\"\")
-    lines.append(\"[build-system]\")
-    requires = bs.get(\"requires\", [\"poetry-core>=1.9.0\"])
-    requires_items = \", \".join(f'\"{toml_escape(x)}\"' for x in requires)
-    lines.append(f\"requires = [{requires_items}]\")
-    lines.append(f'build-backend = \"{toml_escape(bs.get(\"build-backend\", \"poetry.core.masonry.api\"))}\"')
+    groups = poetry.get("group", {}) if isinstance(poetry.get("group", {}), dict) else {}
+    dev_group = groups.get("dev", {})
+    dev_deps = poetry_deps_to_pep621(dev_group.get("dependencies", {}), warnings, cwd)
+    if dev_deps: optional_deps["dev"] = dev_deps
+    if optional_deps: proj["optional-dependencies"] = optional_deps
+    scripts = poetry.get("scripts", {}) or {}
+    if scripts: proj["scripts"] = scripts
+    bs = build_system or {"requires": ["poetry-core>=1.9.0"], "build-backend": "poetry.core.masonry.api"}
+    if tomli_w is not None:
+        # Slot authors in after the scalar fields; update() keeps their positions.
+        project = {k: proj[k] for k in ("name", "version", "description", "readme") if k in proj}
+        if authors: project["authors"] = parse_authors(authors)
+        project.update(proj)
+        text = tomli_w.dumps({"project": project, "build-system": bs})  # no indent=: needs tomli_w>=1.1
+    else:
+        text = dump_pep621_toml(proj, bs, authors)
     if warnings:
-        lines.append(\"\")
-        lines.append(\"# --- Migration notes ---\")
-        for w in warnings: lines.append(\"# \" + w)
-    return \"\\n\".join(lines) + \"\\n\"
+        text += "\n# --- Migration notes ---\n# " + "\n# ".join(warnings) + "\n"
+    return text
 
 
-def migrate_pyproject(pyproject_path: Path, dry_run: bool = False, out_path: Path | None = None) -> Tuple[str, List[str]]:
+def migrate_pyproject(pyproject_path: Path, dry_run: bool = False, out_path: Path | None = None,
+                      cwd: Path | None = None) -> Tuple[str, List[str]]:
     if tomllib is None:
-        raise RuntimeError(\"Python 3.11+ required (tomllib).\" )
-    data = tomllib.loads(pyproject_path.read_text(encoding=\"utf-8\"))
-    poetry = data.get(\"tool\", {}).get(\"poetry\", {})
+        raise RuntimeError("Python 3.11+ required (tomllib)." )
+    with pyproject_path.open("rb") as f:
+        data = tomllib.load(f)
+    poetry = data.get("tool", {}).get("poetry", {})
     if not poetry:
-        raise ValueError(\"No [tool.poetry] section found; nothing to migrate.\")
-    build_system = data.get(\"build-system\", {})
+        raise ValueError("No [tool.poetry] section found; nothing to migrate.")
+    build_system = data.get("build-system", {})
     warnings: List[str] = []
-    new_text = build_pep621_toml(poetry, build_system, warnings)
+    # Like Poetry, relative path deps are relative to the pyproject's own directory.
+    new_text = build_pep621_toml(poetry, build_system, warnings, cwd=cwd or pyproject_path.parent.absolute())
     if not dry_run:
-        backup = pyproject_path.with_suffix(\".toml.bak\")
+        backup = pyproject_path.with_suffix(".toml.bak")
         shutil.copy2(pyproject_path, backup)
         target = out_path or pyproject_path
-        target.write_text(new_text, encoding=\"utf-8\")
+        target.write_text(new_text, encoding="utf-8")
     return new_text, warnings
 
 
+def _migrate_one(pyproject_path: Path, dry_run: bool) -> Tuple[Path, str, List[str], str | None]:
+    # Worker for --glob; module-level so ProcessPoolExecutor can pickle it.
+    # Any failure is reported per file so one bad project can't abort the batch.
+    try:
+        text, warnings = migrate_pyproject(pyproject_path, dry_run=dry_run)
+    except Exception as e:
+        return pyproject_path, "", [], f"{type(e).__name__}: {e}"
+    return pyproject_path, text, warnings, None
+
+
+def print_warnings(warnings: List[str], header: str = "Warnings:") -> None:
+    if warnings:
+        print("\n" + header, file=sys.stderr)
+        for w in warnings:
+            print("- " + w, file=sys.stderr)
+
+
+def positive_int(s: str) -> int:
+    n = int(s)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {s}")
+    return n
+
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument(\"pyproject\", type=Path, help=\"Path to pyproject.toml (Poetry style)\")
-    ap.add_argument(\"--dry-run\", action=\"store_true\", help=\"Print converted TOML to stdout; do not write files\")
-    ap.add_argument(\"--out\", type=Path, default=None, help=\"Optional output path. Defaults to overwrite pyproject.toml (with .bak backup)\" )
+    ap.add_argument("pyproject", type=Path, nargs="?", help="Path to pyproject.toml (Poetry style)")
+    ap.add_argument("--dry-run", action="store_true", help="Print converted TOML to stdout; do not write files")
+    ap.add_argument("--out", type=Path, default=None, help="Optional output path. Defaults to overwrite pyproject.toml (with .bak backup)" )
+    ap.add_argument("--glob", metavar="PATTERN", default=None,
+                    help="Migrate every file matching PATTERN (e.g. 'packages/**/pyproject.toml') in parallel")
+    ap.add_argument("--jobs", type=positive_int, default=None, help="Worker processes for --glob. Defaults to the CPU count")
     args = ap.parse_args()
+    if args.glob:
+        if args.pyproject or args.out:
+            ap.error("--glob cannot be combined with a pyproject path or --out")
+    elif not args.pyproject:
+        ap.error("a pyproject path or --glob is required")
+    elif args.jobs is not None:
+        ap.error("--jobs requires --glob")
 
-    text, warnings = migrate_pyproject(args.pyproject, dry_run=args.dry_run, out_path=args.out)
-    if args.dry_run:
-        sys.stdout.write(text)
-    if warnings:
-        print(\"\\nWarnings:\", file=sys.stderr)
-        for w in warnings:
-            print(\"- \" + w, file=sys.stderr)
+    if not args.glob:
+        text, warnings = migrate_pyproject(args.pyproject, dry_run=args.dry_run, out_path=args.out)
+        if args.dry_run:
+            sys.stdout.write(text)
+        print_warnings(warnings)
+        return
+
+    paths = [p for p in map(Path, sorted(glob.glob(args.glob, recursive=True))) if p.is_file()]
+    if not paths:
+        ap.error(f"--glob {args.glob!r} matched no files")
+    failed = False
+    with ProcessPoolExecutor(max_workers=args.jobs) as ex:
+        for path, text, warnings, error in ex.map(_migrate_one, paths, repeat(args.dry_run)):
+            if error:
+                failed = True
+                print(f"Skipped {path}: {error}", file=sys.stderr)
+                continue
+            if args.dry_run:
+                sys.stdout.write(f"# ==> {path} <==\n{text}\n")
+            print_warnings(warnings, f"Warnings ({path}):")
+    if failed:
+        sys.exit(1)
 
 
-if __name__ == \"__main__\":
+if __name__ == "__main__":
     main()